@@ -11,6 +11,8 @@ from headers import create_level_2_headers
 from datetime import datetime, timedelta
 import pandas as pd
 import numpy as np
+from rollups import RollupPyramid
+from scheduler import RefreshScheduler, REQUESTS_PER_SECOND
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -18,6 +20,17 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 # NOTE: Set this to True to use API calls, False to use extended datasets
 USE_API = False
 
+# Price history fidelity in minutes requested from '/prices-history'
+FIDELITY_MINUTES = 60
+
+# Days of price history requested per fetch
+HISTORY_DAYS = 30
+
+ROLLUP_DIR = os.path.join('poly_data', 'rollups')
+
+# Persisted state for the price history refresh scheduler
+SCHEDULER_STATE_PATH = os.path.join('poly_data', 'scheduler_state.json')
+
 def process_market_data(market_data):
     processed_markets = []
     for market in market_data:
@@ -72,14 +85,14 @@ def get_market_data(client, signer, api_creds, host):
         traceback.print_exc()
         return None
 
-def get_timeseries_data(client, signer, api_creds, host, token_id):
+def get_timeseries_data(client, signer, api_creds, host, token_id, fidelity=FIDELITY_MINUTES):
     try:
         end_ts = int(time.time())
-        start_ts = end_ts - (30 * 24 * 60 * 60)  # 30 days ago
+        start_ts = end_ts - (HISTORY_DAYS * 24 * 60 * 60)
         
         request_args = RequestArgs(
             method="GET",
-            request_path=f"/prices-history?market={token_id}&startTs={start_ts}&endTs={end_ts}&fidelity=60",
+            request_path=f"/prices-history?market={token_id}&startTs={start_ts}&endTs={end_ts}&fidelity={fidelity}",
             body="",
         )
         
@@ -133,6 +146,36 @@ def merge_market_and_timeseries_data(market_data, time_series_data):
 
     return merged_data
 
+def load_latest_volatility(enhanced_data_path):
+    # Latest volatility_24h per token from the previous run's enhanced dataset
+    if not os.path.exists(enhanced_data_path):
+        return {}
+    enhanced = pd.read_csv(enhanced_data_path, usecols=['token_id', 'timestamp', 'volatility_24h'], dtype={'token_id': str})
+    latest = enhanced.dropna(subset=['volatility_24h']).sort_values('timestamp').groupby('token_id').last()
+    return latest['volatility_24h'].to_dict()
+
+def to_epoch(timestamps):
+    # Timestamp strings are written with datetime.fromtimestamp, so read them back as local time
+    return [int(datetime.strptime(str(ts), '%Y-%m-%d %H:%M:%S').timestamp()) for ts in timestamps]
+
+def rollup_timeseries(pyramid, timeseries_df, resolution=60 * 60):
+    # Rebuild the time series at a coarser resolution using the last price of each bar
+    tokens = timeseries_df.drop_duplicates('token_id').set_index('token_id')
+    epoch = to_epoch(timeseries_df['timestamp'])
+    start_ts, end_ts = min(epoch), max(epoch) + 1
+
+    rows = []
+    for token_id, token in tokens.iterrows():
+        for bar in pyramid.query(str(token_id), start_ts, end_ts, resolution):
+            rows.append({
+                'token_id': token_id,
+                'token_outcome': token['token_outcome'],
+                'market_slug': token['market_slug'],
+                'timestamp': datetime.fromtimestamp(bar['timestamp']).strftime('%Y-%m-%d %H:%M:%S'),
+                'price': bar['close']
+            })
+    return pd.DataFrame(rows, columns=timeseries_df.columns)
+
 def add_features(df):
     # Convert timestamp to datetime
     df['timestamp'] = pd.to_datetime(df['timestamp'])
@@ -187,6 +230,10 @@ def main():
                 raise ValueError("API credentials not found in environment variables. Please check your .env file.")
             
             api_creds = ApiCreds(api_key=api_key, api_secret=api_secret, api_passphrase=api_passphrase)
+
+            # Keep 1m bars a day past the fetch window so re-fetched points are still deduped
+            pyramid = RollupPyramid.load(ROLLUP_DIR, retention=(HISTORY_DAYS + 1) * 24 * 60 * 60)
+            pyramid.prune(time.time())
             
             processed_markets = get_market_data(client, signer, api_creds, host)
             
@@ -199,27 +246,58 @@ def main():
                 df.to_csv(csv_path, index=False)
                 logging.info(f"Market data saved to {csv_path}")
                 
-                # Collect timeseries data
-                timeseries_data = []
+                # Schedule price history refreshes by market status, end date and recent volatility
+                scheduler = RefreshScheduler(SCHEDULER_STATE_PATH, requests_per_second=REQUESTS_PER_SECOND)
+                volatility = load_latest_volatility(os.path.join('poly_data', 'enhanced_linked_data.csv'))
+                token_info = {}
                 for _, row in df.iterrows():
                     for i in range(1, 3):  # Assuming there are always 2 tokens
-                        token_id = row[f'token_{i}_id']
-                        token_outcome = row[f'token_{i}_outcome']
-                        history = get_timeseries_data(client, signer, api_creds, host, token_id)
-                        if history:
-                            for point in history:
-                                timeseries_data.append({
-                                    'token_id': token_id,
-                                    'token_outcome': token_outcome,
-                                    'market_slug': row['market_slug'],
-                                    'timestamp': datetime.fromtimestamp(point['t']).strftime('%Y-%m-%d %H:%M:%S'),
-                                    'price': point['p']
-                                })
-                
-                timeseries_df = pd.DataFrame(timeseries_data)
+                        token_id = str(row[f'token_{i}_id'])
+                        token_info[token_id] = (row[f'token_{i}_outcome'], row['market_slug'])
+                        scheduler.update_token(token_id, row['status'], row['end_date'], volatility.get(token_id))
+
+                logging.info(f"Staleness percentiles before refresh (seconds): {scheduler.staleness_percentiles()}")
+                results = scheduler.run(
+                    lambda token_id: get_timeseries_data(client, signer, api_creds, host, token_id, fidelity=FIDELITY_MINUTES)
+                )
+
+                # Collect timeseries data
+                timeseries_data = []
+                for token_id, history in results.items():
+                    if history:
+                        pyramid.add_points(token_id, history)
+                        token_outcome, market_slug = token_info[token_id]
+                        for point in history:
+                            timeseries_data.append({
+                                'token_id': token_id,
+                                'token_outcome': token_outcome,
+                                'market_slug': market_slug,
+                                'timestamp': datetime.fromtimestamp(point['t']).strftime('%Y-%m-%d %H:%M:%S'),
+                                'price': point['p']
+                            })
+
+                timeseries_df = pd.DataFrame(timeseries_data, columns=['token_id', 'token_outcome', 'market_slug', 'timestamp', 'price'])
                 timeseries_csv_path = os.path.join('poly_data', 'time_series_data.csv')
+
+                # Keep previous history for tokens that were not due a refresh
+                if os.path.exists(timeseries_csv_path):
+                    previous_df = pd.read_csv(timeseries_csv_path, dtype={'token_id': str})
+                    previous_df = previous_df[~previous_df['token_id'].isin(timeseries_df['token_id'])]
+                    timeseries_df = pd.concat([previous_df, timeseries_df], ignore_index=True)
+
                 timeseries_df.to_csv(timeseries_csv_path, index=False)
                 logging.info(f"Time series data saved to {timeseries_csv_path}")
+
+                pyramid.save(ROLLUP_DIR)
+                logging.info(f"Price rollups saved to {ROLLUP_DIR}")
+
+                # Only mark tokens fresh once their data is on disk
+                scheduler.save()
+
+                # Features are computed on hourly bars, so collapse finer fidelity first
+                if FIDELITY_MINUTES < 60:
+                    timeseries_df = rollup_timeseries(pyramid, timeseries_df)
+                    logging.info(f"Rolled time series up to {len(timeseries_df)} hourly rows")
             else:
                 logging.error("Failed to retrieve market data.")
                 return
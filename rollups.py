@@ -0,0 +1,213 @@
+import csv
+import json
+import logging
+import os
+
+# Rollup levels in seconds, finest first
+LEVELS = {
+    "1m": 60,
+    "1h": 60 * 60,
+    "1d": 24 * 60 * 60,
+}
+
+# How long finest-level bars, and the timestamps used to dedupe them, are kept
+FINEST_RETENTION = 31 * 24 * 60 * 60
+
+ROLLUP_FIELDS = ["token_id", "timestamp", "open", "high", "low", "close", "count", "first_ts", "last_ts", "seen"]
+
+
+class RollupPyramid:
+    """
+    Keeps OHLC/last/count bars for each token at every level in LEVELS.
+
+    Points are folded into every level as they arrive, so a query never has to
+    touch the raw price history. Bars at the finest level remember the
+    timestamps they hold, which is how re-fetched points are recognised.
+
+    Finest-level bars are only kept for the retention window; prune() drops
+    older ones and moves the horizon forward. Points before the horizon can
+    no longer be deduped, so they are rejected rather than double counted in
+    the coarser levels.
+    """
+
+    def __init__(self, levels=None, retention=FINEST_RETENTION):
+        self.levels = dict(sorted((levels or LEVELS).items(), key=lambda item: item[1]))
+        self.finest = next(iter(self.levels))
+        self.retention = retention
+        # Oldest timestamp that can still be ingested
+        self.horizon = 0
+        # level name -> token_id -> bucket start -> bar
+        self.bars = {name: {} for name in self.levels}
+
+    def add_point(self, token_id, ts, price):
+        """
+        Folds a single price point into every level. A point whose timestamp
+        is already in the pyramid is skipped, so re-fetching an overlapping
+        window is harmless while late or finer-grained points still land.
+        Returns True if the point was ingested.
+        """
+        ts = int(ts)
+        price = float(price)
+        if ts < self.horizon:
+            return False
+        size = self.levels[self.finest]
+        finest_bar = self.bars[self.finest].get(token_id, {}).get(ts - ts % size)
+        if finest_bar is not None and ts in finest_bar["seen"]:
+            return False
+
+        for name, size in self.levels.items():
+            buckets = self.bars[name].setdefault(token_id, {})
+            start = ts - ts % size
+            bar = buckets.get(start)
+            if bar is None:
+                buckets[start] = {
+                    "open": price, "high": price, "low": price, "close": price,
+                    "count": 1, "first_ts": ts, "last_ts": ts,
+                }
+                if name == self.finest:
+                    buckets[start]["seen"] = {ts}
+                continue
+            bar["high"] = max(bar["high"], price)
+            bar["low"] = min(bar["low"], price)
+            bar["count"] += 1
+            if ts < bar["first_ts"]:
+                bar["open"] = price
+                bar["first_ts"] = ts
+            if ts >= bar["last_ts"]:
+                bar["close"] = price
+                bar["last_ts"] = ts
+            if name == self.finest:
+                bar["seen"].add(ts)
+
+        return True
+
+    def add_points(self, token_id, history):
+        """
+        Ingests a '/prices-history' style list of {'t': ..., 'p': ...} points.
+        Returns the number of points ingested; skipped points are logged.
+        """
+        added = 0
+        for point in history:
+            if self.add_point(token_id, point['t'], point['p']):
+                added += 1
+        skipped = len(history) - added
+        if skipped:
+            logging.debug(f"Skipped {skipped} duplicate or expired points for token {token_id}")
+        return added
+
+    def prune(self, now):
+        """
+        Drops finest-level bars that have fallen out of the retention window.
+        Returns the number of bars removed.
+        """
+        size = self.levels[self.finest]
+        horizon = int(now) - self.retention
+        self.horizon = max(self.horizon, horizon - horizon % size)
+
+        removed = 0
+        for buckets in self.bars[self.finest].values():
+            for start in [start for start in buckets if start < self.horizon]:
+                del buckets[start]
+                removed += 1
+        return removed
+
+    def pick_level(self, start_ts, end_ts, resolution):
+        """
+        Returns the coarsest level whose bars fit inside the requested
+        resolution.
+        """
+        finest_size = self.levels[self.finest]
+        if resolution < finest_size or resolution % finest_size != 0:
+            raise ValueError(f"Resolution {resolution}s is not a multiple of the finest rollup level ({finest_size}s)")
+
+        chosen = self.finest
+        for name, size in self.levels.items():
+            if resolution % size == 0:
+                chosen = name
+        return chosen
+
+    def query(self, token_id, start_ts, end_ts, resolution):
+        """
+        Returns bars for token_id covering [start_ts, end_ts) at the requested
+        resolution in seconds, built from the coarsest usable level.
+
+        The range is widened to the edges of that level's bars, so an
+        unaligned range also returns the points that share its first and last
+        bars. Finest-level bars are only available inside the retention window.
+        """
+        name = self.pick_level(start_ts, end_ts, resolution)
+        size = self.levels[name]
+        buckets = self.bars[name].get(token_id, {})
+
+        result = []
+        current = None
+        for start in range(start_ts - start_ts % size, end_ts, size):
+            bar = buckets.get(start)
+            if bar is None:
+                continue
+            out_start = start - start % resolution
+            if current is None or current["timestamp"] != out_start:
+                current = {"timestamp": out_start, **{k: bar[k] for k in ("open", "high", "low", "close", "count")}}
+                result.append(current)
+                continue
+            current["high"] = max(current["high"], bar["high"])
+            current["low"] = min(current["low"], bar["low"])
+            current["close"] = bar["close"]
+            current["count"] += bar["count"]
+
+        return result
+
+    def save(self, directory):
+        """
+        Writes one CSV per level to directory.
+        """
+        os.makedirs(directory, exist_ok=True)
+        for name in self.levels:
+            with open(rollup_path(directory, name), "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=ROLLUP_FIELDS)
+                writer.writeheader()
+                for token_id, buckets in self.bars[name].items():
+                    for start in sorted(buckets):
+                        bar = buckets[start]
+                        seen = " ".join(str(ts) for ts in sorted(bar.get("seen", ())))
+                        writer.writerow({"token_id": token_id, "timestamp": start, **bar, "seen": seen})
+
+        with open(meta_path(directory), "w") as f:
+            json.dump({"horizon": self.horizon}, f)
+
+    @classmethod
+    def load(cls, directory, levels=None, retention=FINEST_RETENTION):
+        """
+        Reads rollups written by save(). Missing files give an empty pyramid.
+        """
+        pyramid = cls(levels, retention)
+        if os.path.exists(meta_path(directory)):
+            with open(meta_path(directory)) as f:
+                pyramid.horizon = json.load(f).get("horizon", 0)
+        for name in pyramid.levels:
+            path = rollup_path(directory, name)
+            if not os.path.exists(path):
+                continue
+            with open(path, newline="") as f:
+                for row in csv.DictReader(f):
+                    bar = {
+                        "open": float(row["open"]),
+                        "high": float(row["high"]),
+                        "low": float(row["low"]),
+                        "close": float(row["close"]),
+                        "count": int(row["count"]),
+                        "first_ts": int(row["first_ts"]),
+                        "last_ts": int(row["last_ts"]),
+                    }
+                    if name == pyramid.finest:
+                        bar["seen"] = {int(ts) for ts in row["seen"].split()}
+                    pyramid.bars[name].setdefault(row["token_id"], {})[int(row["timestamp"])] = bar
+        return pyramid
+
+
+def rollup_path(directory, level_name):
+    return os.path.join(directory, f"rollups_{level_name}.csv")
+
+
+def meta_path(directory):
+    return os.path.join(directory, "rollups_meta.json")
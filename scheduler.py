@@ -0,0 +1,181 @@
+import heapq
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+
+# Default request budget for CLOB price history fetches
+REQUESTS_PER_SECOND = 2.0
+
+MIN_INTERVAL = 60
+INACTIVE_INTERVAL = 7 * 24 * 60 * 60
+
+# (days until end, refresh interval in seconds), checked in order
+END_DATE_INTERVALS = [
+    (1, 5 * 60),
+    (7, 60 * 60),
+    (30, 6 * 60 * 60),
+]
+DEFAULT_INTERVAL = 24 * 60 * 60
+
+# How strongly recent volatility shortens the refresh interval
+VOLATILITY_WEIGHT = 20
+
+
+def days_until_end(end_date, now):
+    """
+    Returns days from now (unix seconds) to end_date, a UTC timestamp string
+    as written by process_market_data, or None if end_date is missing or
+    unparseable.
+    """
+    if end_date in (None, "", "N/A"):
+        return None
+    try:
+        end_ts = datetime.strptime(str(end_date), "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+    except ValueError:
+        return None
+    return (end_ts - now) / (24 * 60 * 60)
+
+
+def refresh_interval(status, days_left=None, volatility_24h=None):
+    """
+    Returns how many seconds a token's price history stays fresh.
+    """
+    if status != "Active" or (days_left is not None and days_left < 0):
+        return INACTIVE_INTERVAL
+
+    interval = DEFAULT_INTERVAL
+    if days_left is not None:
+        for max_days, seconds in END_DATE_INTERVALS:
+            if days_left < max_days:
+                interval = seconds
+                break
+
+    if volatility_24h is not None and volatility_24h == volatility_24h:  # skip NaN
+        interval = interval / (1 + VOLATILITY_WEIGHT * abs(volatility_24h))
+
+    return max(MIN_INTERVAL, interval)
+
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of an unsorted list.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+class RefreshScheduler:
+    """
+    Decides which tokens to re-fetch and dispatches them most-overdue first,
+    without exceeding the configured requests/sec budget.
+
+    Only tokens passed to update_token() are scheduled, so tokens kept in the
+    persisted state but missing from the current market list are left alone.
+    clock and sleep default to time.time and time.sleep and can be replaced
+    with a simulated clock.
+    """
+
+    def __init__(self, state_path=None, requests_per_second=REQUESTS_PER_SECOND, clock=time.time, sleep=time.sleep):
+        if requests_per_second <= 0:
+            raise ValueError("requests_per_second must be positive")
+        self.state_path = state_path
+        self.requests_per_second = requests_per_second
+        self.clock = clock
+        self.sleep = sleep
+        # token_id -> {'interval': seconds, 'last_fetch': unix seconds or None}
+        self.tokens = {}
+        # Tokens updated since this scheduler was created
+        self.active = set()
+        self._next_request_at = 0.0
+
+        if state_path and os.path.exists(state_path):
+            self.load()
+
+    def update_token(self, token_id, status, end_date=None, volatility_24h=None):
+        """
+        Recomputes a token's refresh interval from its latest market data.
+        """
+        token_id = str(token_id)
+        days_left = days_until_end(end_date, self.clock())
+        entry = self.tokens.setdefault(token_id, {"interval": DEFAULT_INTERVAL, "last_fetch": None})
+        entry["interval"] = refresh_interval(status, days_left, volatility_24h)
+        self.active.add(token_id)
+
+    def overdue(self, token_id, now=None):
+        """
+        Returns how many intervals have passed since the last fetch. Tokens
+        that were never fetched are infinitely overdue.
+        """
+        entry = self.tokens[token_id]
+        if entry["last_fetch"] is None:
+            return float("inf")
+        now = self.clock() if now is None else now
+        return (now - entry["last_fetch"]) / entry["interval"]
+
+    def due_tokens(self):
+        """
+        Returns a heap of (-overdue, interval, token_id) for every active token
+        due a refresh. Ties, such as tokens never fetched, go to the shortest interval.
+        """
+        now = self.clock()
+        queue = []
+        for token_id in self.active:
+            score = self.overdue(token_id, now)
+            if score >= 1:
+                queue.append((-score, self.tokens[token_id]["interval"], token_id))
+        heapq.heapify(queue)
+        return queue
+
+    def _wait_for_budget(self):
+        now = self.clock()
+        if now < self._next_request_at:
+            self.sleep(self._next_request_at - now)
+            now = self.clock()
+        self._next_request_at = max(now, self._next_request_at) + 1 / self.requests_per_second
+
+    def run(self, fetch, max_requests=None):
+        """
+        Calls fetch(token_id) for due tokens in priority order and returns a
+        dict of token_id -> fetch result. A token only counts as refreshed
+        when fetch returns something other than None. State is not saved
+        here; call save() once the fetched data has been stored.
+        """
+        queue = self.due_tokens()
+        results = {}
+        while queue and (max_requests is None or len(results) < max_requests):
+            _, _, token_id = heapq.heappop(queue)
+            self._wait_for_budget()
+            result = fetch(token_id)
+            results[token_id] = result
+            if result is not None:
+                self.tokens[token_id]["last_fetch"] = self.clock()
+
+        logging.info(f"Refreshed {sum(r is not None for r in results.values())} of {len(results)} scheduled tokens, {len(queue)} still due")
+        return results
+
+    def staleness_percentiles(self, percentiles=(50, 90, 99)):
+        """
+        Returns {pct: seconds since last fetch} across fetched active tokens,
+        plus the number of active tokens never fetched under 'never_fetched'.
+        Call it before run() to see how stale the data was when dispatched.
+        """
+        now = self.clock()
+        entries = [self.tokens[token_id] for token_id in self.active]
+        ages = [now - e["last_fetch"] for e in entries if e["last_fetch"] is not None]
+        report = {pct: percentile(ages, pct) for pct in percentiles}
+        report["never_fetched"] = len(entries) - len(ages)
+        return report
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        with open(self.state_path, "w") as f:
+            json.dump({"tokens": self.tokens}, f)
+
+    def load(self):
+        with open(self.state_path) as f:
+            self.tokens = json.load(f).get("tokens", {})
@@ -0,0 +1,139 @@
+import pytest
+
+from rollups import FINEST_RETENTION, RollupPyramid
+
+DAY = 24 * 60 * 60
+# 2023-11-14 00:00:00 UTC, aligned to every level
+BASE = 1699920000
+
+
+def test_add_point_updates_every_level():
+    pyramid = RollupPyramid()
+    assert pyramid.add_point("a", BASE + 5, 0.5)
+    assert pyramid.add_point("a", BASE + 30, 0.7)
+    assert pyramid.add_point("a", BASE + 50, 0.4)
+
+    for name in ("1m", "1h", "1d"):
+        bar = pyramid.bars[name]["a"][BASE]
+        assert (bar["open"], bar["high"], bar["low"], bar["close"], bar["count"]) == (0.5, 0.7, 0.4, 0.4, 3)
+
+
+def test_add_point_bucket_boundaries():
+    pyramid = RollupPyramid()
+    pyramid.add_point("a", BASE + 59, 0.1)
+    pyramid.add_point("a", BASE + 60, 0.2)
+    pyramid.add_point("a", BASE + 3599, 0.3)
+    pyramid.add_point("a", BASE + 3600, 0.4)
+
+    assert sorted(pyramid.bars["1m"]["a"]) == [BASE, BASE + 60, BASE + 3540, BASE + 3600]
+    assert sorted(pyramid.bars["1h"]["a"]) == [BASE, BASE + 3600]
+    assert pyramid.bars["1h"]["a"][BASE]["close"] == 0.3
+    assert list(pyramid.bars["1d"]["a"]) == [BASE]
+
+
+def test_add_point_skips_duplicates_but_keeps_late_points():
+    pyramid = RollupPyramid()
+    pyramid.add_point("a", BASE + 3600, 0.5)
+    assert not pyramid.add_point("a", BASE + 3600, 0.9)
+
+    # A late point and a finer-grained point inside the ingested window both land
+    assert pyramid.add_point("a", BASE, 0.2)
+    assert pyramid.add_point("a", BASE + 3660, 0.6)
+
+    day = pyramid.bars["1d"]["a"][BASE]
+    assert (day["open"], day["close"], day["count"]) == (0.2, 0.6, 3)
+
+
+def test_add_points_returns_ingested_count():
+    pyramid = RollupPyramid()
+    history = [{"t": BASE, "p": 0.1}, {"t": BASE + 60, "p": 0.2}]
+    assert pyramid.add_points("a", history) == 2
+    assert pyramid.add_points("a", history + [{"t": BASE + 120, "p": 0.3}]) == 1
+
+
+def test_pick_level_uses_coarsest_level_within_resolution():
+    pyramid = RollupPyramid()
+    assert pyramid.pick_level(BASE, BASE + 2 * DAY, DAY) == "1d"
+    assert pyramid.pick_level(BASE, BASE + 2 * DAY, 3600) == "1h"
+    assert pyramid.pick_level(BASE + 3600, BASE + DAY, 2 * 3600) == "1h"
+    assert pyramid.pick_level(BASE + 30, BASE + DAY, 120) == "1m"
+    # Unaligned ranges still use the coarse levels
+    assert pyramid.pick_level(BASE + 1234, BASE + 90 * DAY + 567, DAY) == "1d"
+
+
+@pytest.mark.parametrize("resolution", [30, 90, 3601])
+def test_pick_level_rejects_unsupported_resolution(resolution):
+    with pytest.raises(ValueError):
+        RollupPyramid().pick_level(BASE, BASE + DAY, resolution)
+
+
+def test_query_rolls_up_to_requested_resolution():
+    pyramid = RollupPyramid()
+    for i in range(0, 2 * DAY, 30):
+        pyramid.add_point("a", BASE + i, i / DAY)
+
+    bars = pyramid.query("a", BASE, BASE + 2 * DAY, DAY)
+    assert [b["timestamp"] for b in bars] == [BASE, BASE + DAY]
+    assert [b["count"] for b in bars] == [2880, 2880]
+    assert bars[1]["open"] == 1.0
+
+    bars = pyramid.query("a", BASE, BASE + 2 * DAY, 2 * 3600)
+    assert len(bars) == 24
+    assert all(b["count"] == 240 for b in bars)
+
+
+def test_query_unaligned_range_widens_to_level_edges():
+    pyramid = RollupPyramid()
+    for i in range(0, 600, 30):
+        pyramid.add_point("a", BASE + i, i)
+
+    # [+90, +400) widens to the 1m bars [+60, +420)
+    bars = pyramid.query("a", BASE + 90, BASE + 400, 120)
+    assert [b["timestamp"] for b in bars] == [BASE, BASE + 120, BASE + 240, BASE + 360]
+    assert [b["count"] for b in bars] == [2, 4, 4, 2]
+    assert bars[0]["open"] == 60
+    assert bars[-1]["close"] == 390
+
+
+def test_query_unaligned_daily_range_uses_daily_bars():
+    pyramid = RollupPyramid()
+    for i in range(0, 3 * DAY, 3600):
+        pyramid.add_point("a", BASE + i, i / DAY)
+
+    bars = pyramid.query("a", BASE + 1234, BASE + 2 * DAY + 567, DAY)
+    assert [b["timestamp"] for b in bars] == [BASE, BASE + DAY, BASE + 2 * DAY]
+    assert [b["count"] for b in bars] == [24, 24, 24]
+
+
+def test_query_unknown_token_is_empty():
+    assert RollupPyramid().query("missing", BASE, BASE + DAY, 3600) == []
+
+
+def test_prune_drops_old_finest_bars_and_rejects_expired_points():
+    pyramid = RollupPyramid(retention=DAY)
+    pyramid.add_point("a", BASE, 0.1)
+    pyramid.add_point("a", BASE + DAY + 60, 0.2)
+
+    assert pyramid.prune(BASE + 2 * DAY) == 1
+    assert list(pyramid.bars["1m"]["a"]) == [BASE + DAY + 60]
+    # Coarser levels keep the full history
+    assert pyramid.bars["1d"]["a"][BASE]["count"] == 1
+
+    # The pruned point can no longer be deduped, so it is not counted again
+    assert not pyramid.add_point("a", BASE, 0.1)
+    assert pyramid.bars["1d"]["a"][BASE]["count"] == 1
+
+
+def test_save_and_load_round_trip(tmp_path):
+    pyramid = RollupPyramid()
+    for i in range(0, 7200, 600):
+        pyramid.add_point("a", BASE + i, i / 7200)
+    pyramid.prune(BASE + FINEST_RETENTION + 3600)
+    pyramid.save(tmp_path)
+
+    loaded = RollupPyramid.load(tmp_path)
+    assert loaded.bars == pyramid.bars
+    assert loaded.horizon == pyramid.horizon == BASE + 3600
+    assert not loaded.add_point("a", BASE + 600, 0.5)
+    assert not loaded.add_point("a", BASE + 3600, 0.5)
+    assert loaded.add_point("a", BASE + 3601, 0.5)
@@ -0,0 +1,247 @@
+import json
+import threading
+import time
+import urllib.request
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from scheduler import (
+    DEFAULT_INTERVAL,
+    INACTIVE_INTERVAL,
+    RefreshScheduler,
+    days_until_end,
+    percentile,
+    refresh_interval,
+)
+
+# 2023-11-14 00:00:00 UTC
+START = 1699920000.0
+
+
+class FakeClock:
+    def __init__(self, now=START):
+        self.now = now
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def end_date(clock, days):
+    return datetime.fromtimestamp(clock() + days * 24 * 60 * 60, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def mock_server():
+    requests_seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests_seen.append((self.path, dict(self.headers)))
+            body = json.dumps({"history": [{"t": int(START), "p": 0.5}]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}", requests_seen
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def new_york_tz(monkeypatch):
+    monkeypatch.setenv("TZ", "America/New_York")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_days_until_end_reads_utc(clock, new_york_tz):
+    assert days_until_end(end_date(clock, 1 / 24), clock()) == pytest.approx(1 / 24)
+    assert days_until_end("N/A", clock()) is None
+    assert days_until_end("not a date", clock()) is None
+
+
+def test_refresh_interval_tiers():
+    assert refresh_interval("Inactive", 0.5) == INACTIVE_INTERVAL
+    assert refresh_interval("Active", -1) == INACTIVE_INTERVAL
+    assert refresh_interval("Active", 0.5) == 5 * 60
+    assert refresh_interval("Active", 3) == 60 * 60
+    assert refresh_interval("Active", 180) == DEFAULT_INTERVAL
+    assert refresh_interval("Active", None) == DEFAULT_INTERVAL
+    assert refresh_interval("Active", 180, 0.05) == DEFAULT_INTERVAL / 2
+    assert refresh_interval("Active", 0.5, float("nan")) == 5 * 60
+
+
+def test_percentile():
+    assert percentile([], 50) is None
+    assert percentile([3, 1, 2, 4], 50) == 2
+    assert percentile(list(range(1, 101)), 90) == 90
+
+
+def test_run_paces_to_requests_per_second(clock):
+    scheduler = RefreshScheduler(requests_per_second=4, clock=clock, sleep=clock.sleep)
+    for token_id in "abcde":
+        scheduler.update_token(token_id, "Active")
+
+    fetched_at = []
+    scheduler.run(lambda token_id: fetched_at.append(clock()) or [])
+
+    assert len(fetched_at) == 5
+    gaps = [b - a for a, b in zip(fetched_at, fetched_at[1:])]
+    assert gaps == pytest.approx([0.25] * 4)
+
+
+def test_run_dispatches_most_overdue_first(clock):
+    scheduler = RefreshScheduler(clock=clock, sleep=clock.sleep)
+    scheduler.update_token("far", "Active", end_date(clock, 180))
+    scheduler.update_token("soon", "Active", end_date(clock, 0.5))
+    scheduler.update_token("week", "Active", end_date(clock, 3))
+    scheduler.update_token("dead", "Inactive")
+
+    # Never fetched tokens go shortest interval first
+    order = []
+    scheduler.run(lambda token_id: order.append(token_id) or [])
+    assert order == ["soon", "week", "far", "dead"]
+
+    # Two hours later: 'soon' is 24 intervals overdue, 'week' 2, the rest not due
+    clock.now += 2 * 60 * 60
+    order = []
+    scheduler.run(lambda token_id: order.append(token_id) or [])
+    assert order == ["soon", "week"]
+
+
+def test_run_retries_failed_fetches(clock):
+    scheduler = RefreshScheduler(clock=clock, sleep=clock.sleep)
+    scheduler.update_token("a", "Active")
+    assert scheduler.run(lambda token_id: None) == {"a": None}
+    assert scheduler.run(lambda token_id: []) == {"a": []}
+    assert scheduler.run(lambda token_id: []) == {}
+
+
+def test_run_respects_max_requests(clock):
+    scheduler = RefreshScheduler(clock=clock, sleep=clock.sleep)
+    for token_id in "abc":
+        scheduler.update_token(token_id, "Active")
+    assert len(scheduler.run(lambda token_id: [], max_requests=2)) == 2
+    assert list(scheduler.run(lambda token_id: [])) == ["c"]
+
+
+def test_save_and_load_round_trip(clock, tmp_path):
+    state_path = tmp_path / "state.json"
+    scheduler = RefreshScheduler(state_path, clock=clock, sleep=clock.sleep)
+    scheduler.update_token("a", "Active", end_date(clock, 0.5))
+    scheduler.update_token("b", "Inactive")
+    scheduler.run(lambda token_id: [])
+    scheduler.save()
+
+    clock.now += 600
+    loaded = RefreshScheduler(state_path, clock=clock, sleep=clock.sleep)
+    assert loaded.tokens == scheduler.tokens
+    # Nothing is scheduled until the current market list is applied
+    assert loaded.run(lambda token_id: []) == {}
+
+    loaded.update_token("a", "Active", end_date(clock, 0.5))
+    assert list(loaded.run(lambda token_id: [])) == ["a"]
+    assert loaded.staleness_percentiles((50,)) == {50: 0, "never_fetched": 0}
+
+
+def test_run_does_not_save_state(clock, tmp_path):
+    state_path = tmp_path / "state.json"
+    scheduler = RefreshScheduler(state_path, clock=clock, sleep=clock.sleep)
+    scheduler.update_token("a", "Active")
+    scheduler.run(lambda token_id: [])
+    assert not state_path.exists()
+
+    # A crash before save() leaves the token due on the next run
+    scheduler = RefreshScheduler(state_path, clock=clock, sleep=clock.sleep)
+    scheduler.update_token("a", "Active")
+    assert list(scheduler.run(lambda token_id: [])) == ["a"]
+
+
+def test_tokens_missing_from_current_run_are_not_fetched(clock, tmp_path):
+    state_path = tmp_path / "state.json"
+    scheduler = RefreshScheduler(state_path, clock=clock, sleep=clock.sleep)
+    scheduler.update_token("a", "Active")
+    scheduler.update_token("b", "Active")
+    scheduler.run(lambda token_id: [])
+    scheduler.save()
+
+    clock.now += 2 * DEFAULT_INTERVAL
+    scheduler = RefreshScheduler(state_path, clock=clock, sleep=clock.sleep)
+    scheduler.update_token("a", "Active")
+    assert list(scheduler.run(lambda token_id: [])) == ["a"]
+    assert "b" in scheduler.tokens
+
+
+def test_staleness_percentiles(clock):
+    scheduler = RefreshScheduler(clock=clock, sleep=clock.sleep)
+    for token_id in "abcd":
+        scheduler.update_token(token_id, "Active")
+    scheduler.run(lambda token_id: [] if token_id != "d" else None)
+
+    clock.now += 100
+    report = scheduler.staleness_percentiles((50, 100))
+    assert report["never_fetched"] == 1
+    # Fetches were paced 0.5s apart, so ages are 101.5, 101 and 100.5
+    assert report[100] == pytest.approx(101.5)
+    assert report[50] == pytest.approx(101)
+
+
+def test_run_against_mock_server(clock, mock_server):
+    host, requests_seen = mock_server
+    scheduler = RefreshScheduler(requests_per_second=10, clock=clock, sleep=clock.sleep)
+    scheduler.update_token("a", "Active", end_date(clock, 0.5))
+    scheduler.update_token("b", "Inactive")
+
+    def fetch(token_id):
+        with urllib.request.urlopen(f"{host}/prices-history?market={token_id}") as response:
+            return json.load(response)["history"]
+
+    results = scheduler.run(fetch)
+    assert [path for path, _ in requests_seen] == ["/prices-history?market=a", "/prices-history?market=b"]
+    assert results["a"] == [{"t": int(START), "p": 0.5}]
+    assert clock.sleeps == pytest.approx([0.1])
+
+
+def test_get_timeseries_data_against_mock_server(mock_server):
+    pytest.importorskip("pandas")
+    pytest.importorskip("dotenv")
+    pytest.importorskip("py_clob_client")
+    pytest.importorskip("eip712_structs")
+    from py_clob_client.clob_types import ApiCreds
+    from py_clob_client.signer import Signer
+
+    import poly
+
+    host, requests_seen = mock_server
+    signer = Signer("0x" + "11" * 32, chain_id=137)
+    creds = ApiCreds(api_key="key", api_secret="c2VjcmV0", api_passphrase="pass")
+
+    history = poly.get_timeseries_data(None, signer, creds, host, "123", fidelity=1)
+
+    assert history == [{"t": int(START), "p": 0.5}]
+    path, headers = requests_seen[0]
+    assert path.startswith("/prices-history?market=123&")
+    assert path.endswith("&fidelity=1")
+    assert headers["POLY_API_KEY"] == "key"